@@ -1,56 +1,252 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
+from flask_compress import Compress
 from flask_cors import CORS
+from flask_limiter import Limiter
+from flask_orjson import OrjsonProvider
 from datetime import datetime
-from collections import deque, defaultdict
-import time
-import json
+import ahocorasick
+import atexit
+import brotli
+import gzip
+import hashlib
+import mmap
+import queue
+import threading
 import os
+import orjson
 
 app = Flask(__name__)
+# orjson-backed jsonify()
+app.json = OrjsonProvider(app)
 # Allow Squarespace domain
 CORS(app, origins=["https://kellinnovations.com"])
+# gzip/brotli for JSON responses when the client accepts it
+COMPRESS_ALGORITHMS = ["br", "gzip"]
+app.config["COMPRESS_ALGORITHM"] = COMPRESS_ALGORITHMS
+Compress(app)
 
 # -----------------------
 # Persistent storage
 # -----------------------
-POSTS_FILE = "posts.json"
+# Append-only log: one post per line, deletes are {"id": ..., "_del": true}
+POSTS_FILE = "posts.jsonl"
+LEGACY_POSTS_FILE = "posts.json"
+# Rewrite the log once more than this share of its lines are dead
+COMPACT_RATIO = 0.25
+
+def iter_mapped_lines(path):
+    """Yield each line of a file as a zero-copy view into an mmap of it."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # empty files can't be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            start = 0
+            while start < len(mm):
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = len(mm)
+                with view[start:end] as line:
+                    yield line
+                start = end + 1
+
+def load_legacy_posts():
+    try:
+        with open(LEGACY_POSTS_FILE, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                memoryview(mm) as view:
+            return orjson.loads(view)
+    except ValueError:  # bad JSON, or an empty file that can't be mapped
+        return []
 
 def load_posts():
-    if os.path.exists(POSTS_FILE):
+    """Replay the log; returns (live posts, total lines, dead lines, torn)."""
+    live = {}
+    total = dead = 0
+    torn = False
+    for line in iter_mapped_lines(POSTS_FILE):
+        total += 1
         try:
-            with open(POSTS_FILE, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
+            rec = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # e.g. a line torn by a crash mid-append
+            dead += 1
+            torn = True
+            continue
+        if rec.get("_del"):
+            # The tombstone and the post it cancels are both dead
+            dead += 2 if live.pop(rec["id"], None) else 1
+        else:
+            if rec["id"] in live:
+                dead += 1
+            live[rec["id"]] = rec
+    return list(live.values()), total, dead, torn
 
-posts = load_posts()
-next_id = max([p["id"] for p in posts], default=0) + 1
-
-def save_posts():
+def write_posts_file(blobs):
     tmp_file = POSTS_FILE + ".tmp"
-    with open(tmp_file, "w") as f:
-        json.dump(posts, f, indent=2)
+    with open(tmp_file, "wb") as f:
+        f.write(b"".join(blob + b"\n" for blob in blobs))
         f.flush()
         os.fsync(f.fileno())
     os.replace(tmp_file, POSTS_FILE)
 
+# Append handle, owned by the writer thread and kept open between batches
+log_file = None
+# Length of posts.jsonl up to the end of the last fully written batch
+log_size = 0
+# Set after a failed append; the next save rewrites the log from memory
+rewrite_pending = False
+
+def append_posts_file(lines):
+    global log_file, log_size
+    if log_file is None:
+        log_file = open(POSTS_FILE, "ab")
+        log_size = os.fstat(log_file.fileno()).st_size
+    data = b"".join(lines)
+    log_file.write(data)
+    log_file.flush()
+    os.fsync(log_file.fileno())
+    log_size += len(data)
+
+def close_log_file():
+    global log_file
+    try:
+        if log_file is not None:
+            # Flushes anything still buffered, which can fail like the write did
+            log_file.close()
+    except OSError:
+        app.logger.exception("Failed to close posts log")
+    finally:
+        log_file = None
+
+def discard_partial_append():
+    # Cut off a half-written batch so the next record doesn't land on it
+    try:
+        os.truncate(POSTS_FILE, log_size)
+    except OSError:
+        app.logger.exception("Failed to truncate posts log")
+
+if os.path.exists(POSTS_FILE):
+    loaded, log_lines, dead_lines, needs_rewrite = load_posts()
+elif os.path.exists(LEGACY_POSTS_FILE):
+    loaded = load_legacy_posts()
+    log_lines, dead_lines, needs_rewrite = 0, 0, True
+else:
+    loaded, log_lines, dead_lines, needs_rewrite = [], 0, 0, False
+
+# Posts are stored as parallel columns, newest-first: post_ids[i] is the id of
+# the post whose JSON is post_blobs[i]. Posts never change once created, so
+# their encoded JSON is all that's needed; no dicts are kept around.
+loaded.sort(key=lambda p: p["id"], reverse=True)
+post_ids = [p["id"] for p in loaded]
+post_blobs = [orjson.dumps(p) for p in loaded]
+live_ids = set(post_ids)
+next_id = post_ids[0] + 1 if post_ids else 1
+del loaded
+# Guards the post columns, live_ids, next_id and the response cache
+posts_lock = threading.Lock()
+
+def compact_post_columns():
+    """Drop deleted posts from the columns; call with posts_lock held."""
+    # Deletes only remove the id from live_ids; the rows go here, in one pass
+    if len(live_ids) == len(post_ids):
+        return
+    kept = [(pid, blob) for pid, blob in zip(post_ids, post_blobs) if pid in live_ids]
+    post_ids[:] = [pid for pid, _ in kept]
+    post_blobs[:] = [blob for _, blob in kept]
+
+# Appending after a torn line would corrupt the next record too
+if needs_rewrite or dead_lines > COMPACT_RATIO * log_lines:
+    write_posts_file(post_blobs[::-1])
+    log_lines, dead_lines = len(post_ids), 0
+
+# Disk writes happen on a background thread so requests don't wait on fsync
+write_q = queue.Queue()
+_COMPACT = object()
+
+def _posts_writer():
+    global rewrite_pending
+    while True:
+        items = [write_q.get()]
+        # Collapse a burst of saves into a single write
+        while True:
+            try:
+                items.append(write_q.get_nowait())
+            except queue.Empty:
+                break
+        compacting = rewrite_pending or any(item is _COMPACT for item in items)
+        try:
+            if compacting:
+                # The snapshot already reflects every queued line; the open
+                # handle would still point at the file being replaced
+                close_log_file()
+                with posts_lock:
+                    compact_post_columns()
+                    snapshot = post_blobs[::-1]
+                write_posts_file(snapshot)
+                rewrite_pending = False
+            else:
+                append_posts_file(items)
+        except Exception:
+            app.logger.exception("Failed to save posts")
+            # log_size is only current while the append handle is open; if
+            # opening failed, nothing was written
+            if not compacting and log_file is not None:
+                close_log_file()
+                discard_partial_append()
+            # The lost lines are still in memory; the next save rewrites them
+            rewrite_pending = True
+        finally:
+            for _ in items:
+                write_q.task_done()
+
+threading.Thread(target=_posts_writer, name="posts-writer", daemon=True).start()
+
+def save_new_post(blob):
+    global log_lines
+    log_lines += 1
+    write_q.put(blob + b"\n")
+
+def save_deleted_post(post_id):
+    global log_lines, dead_lines
+    log_lines += 1
+    dead_lines += 2
+    write_q.put(orjson.dumps({"id": post_id, "_del": True}) + b"\n")
+    if dead_lines > COMPACT_RATIO * log_lines:
+        log_lines, dead_lines = len(live_ids), 0
+        write_q.put(_COMPACT)
+
+def flush_posts():
+    # Block until every queued save has hit disk
+    if rewrite_pending:
+        write_q.put(_COMPACT)
+    write_q.join()
+
+atexit.register(flush_posts)
+
 # -----------------------
 # Rate limiting
 # -----------------------
-RATE_LIMIT_COUNT = 5
-RATE_LIMIT_WINDOW = 3600  # seconds
-ip_timestamps = defaultdict(lambda: deque())
+# In-process by default (gunicorn runs one worker); point this at Redis,
+# e.g. redis://host:6379, to share the quota across processes
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT = "5 per hour"
 
-def check_rate_limit(ip):
-    now = time.time()
-    dq = ip_timestamps[ip]
-    while dq and dq[0] <= now - RATE_LIMIT_WINDOW:
-        dq.popleft()
-    return len(dq) < RATE_LIMIT_COUNT
+def client_ip():
+    return request.headers.get("X-Forwarded-For", request.remote_addr) or "unknown"
 
-def record_post_ip(ip):
-    ip_timestamps[ip].append(time.time())
+limiter = Limiter(
+    client_ip,
+    app=app,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy="moving-window",
+    # If a configured Redis is unreachable, log and let the post through
+    # rather than failing the request
+    swallow_errors=True,
+)
+
+@app.errorhandler(429)
+def rate_limited(e):
+    return jsonify({"error": "Rate limit exceeded. Try again later."}), 429
 
 # -----------------------
 # Spam / length checks
@@ -58,65 +254,137 @@ def record_post_ip(ip):
 MAX_TITLE_LEN = 200
 MAX_NAME_LEN = 100
 MAX_CONTENT_LEN = 5000
+# Matched case-insensitively against title and content
+SPAM_PATTERNS = ("<script", "javascript:")
+
+# One automaton finds any pattern in a single pass, however many there are
+spam_automaton = ahocorasick.Automaton()
+for pattern in SPAM_PATTERNS:
+    spam_automaton.add_word(pattern, pattern)
+spam_automaton.make_automaton()
 
 def sanitize_text(s: str) -> str:
+    # str.strip() hands back s itself when there is nothing to strip
     return s.strip()
 
 def is_spam(title, name, content):
     if len(title) > MAX_TITLE_LEN or len(name) > MAX_NAME_LEN or len(content) > MAX_CONTENT_LEN:
         return True
-    lowered = (title + " " + content).lower()
-    if "<script" in lowered or "javascript:" in lowered:
-        return True
+    # Patterns have no spaces, so no match can straddle title and content
+    for text in (title, content):
+        if next(spam_automaton.iter(text.casefold()), None) is not None:
+            return True
     return False
 
+def validate_post(data):
+    """Clean and check a submitted post; returns ((title, name, content), error)."""
+    title = sanitize_text(data.get("title", ""))
+    name = sanitize_text(data.get("name", "")) or "Anonymous"
+    content = sanitize_text(data.get("content", ""))
+
+    if not title or not content:
+        return None, "Title and content are required."
+
+    if is_spam(title, name, content):
+        return None, "Rejected — failed content checks."
+
+    return (title, name, content), None
+
+def validated_submission():
+    # Validated once per request, ahead of the rate limit, so a bad body is
+    # always answered with 400 rather than 429
+    if "submission" not in g:
+        g.submission = validate_post(request.get_json() or {})
+    return g.submission
+
 # -----------------------
 # Admin key (from environment)
 # -----------------------
 ADMIN_KEY = os.getenv("ADMIN_KEY", "beastydog8")
 
+# -----------------------
+# Response cache
+# -----------------------
+# (body, etag, {encoding: compressed body}) for GET /api/posts; reset
+# whenever posts changes
+_cached_response = None
+
+def invalidate_posts_cache():
+    global _cached_response
+    _cached_response = None
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=app.config["COMPRESS_BR_LEVEL"])
+    return gzip.compress(body, compresslevel=app.config["COMPRESS_LEVEL"])
+
 # -----------------------
 # Routes
 # -----------------------
 @app.route("/api/posts", methods=["GET"])
 def list_posts():
-    return jsonify(list(reversed(posts))), 200
+    global _cached_response
+    cached = _cached_response
+    if cached is None:
+        # Encode under the lock so a concurrent write can't leave a stale cache
+        with posts_lock:
+            if _cached_response is None:
+                compact_post_columns()
+                body = b"[" + b",".join(post_blobs) + b"]"
+                # Content-derived, so it survives restarts and matches across workers
+                etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+                _cached_response = (body, etag, {})
+            cached = _cached_response
+    body, etag, compressed = cached
+
+    # Compressed here, once per encoding per write, instead of by Flask-Compress
+    # on every request; it leaves responses with a Content-Encoding alone
+    encoding = request.accept_encodings.best_match(COMPRESS_ALGORITHMS)
+    if encoding and len(body) >= app.config["COMPRESS_MIN_SIZE"]:
+        if encoding not in compressed:
+            compressed[encoding] = compress_body(body, encoding)
+        body = compressed[encoding]
+    else:
+        encoding = None
+
+    response = app.response_class(body, status=200, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag, weak=True)
+    # Answers a matching If-None-Match with an empty 304
+    return response.make_conditional(request)
 
 @app.route("/api/posts", methods=["POST"])
+# Invalid submissions skip the limit; every other request is a created post,
+# so the check and the hit happen together, atomically, before the view
+@limiter.limit(RATE_LIMIT, exempt_when=lambda: validated_submission()[1] is not None)
 def create_post():
     global next_id
 
-    data = request.get_json() or {}
-    title = sanitize_text(data.get("title", ""))
-    name = sanitize_text(data.get("name", "")) or "Anonymous"
-    content = sanitize_text(data.get("content", ""))
-
-    if not title or not content:
-        return jsonify({"error": "Title and content are required."}), 400
-
-    if is_spam(title, name, content):
-        return jsonify({"error": "Rejected — failed content checks."}), 400
+    fields, error = validated_submission()
+    if error:
+        return jsonify({"error": error}), 400
+    title, name, content = fields
 
-    ip = request.headers.get("X-Forwarded-For", request.remote_addr) or "unknown"
+    with posts_lock:
+        created_at = datetime.utcnow().isoformat() + "Z"
+        post = {
+            "id": next_id,
+            "title": title,
+            "name": name,
+            "content": content,
+            "created_at": created_at
+        }
 
-    if not check_rate_limit(ip):
-        return jsonify({"error": "Rate limit exceeded. Try again later."}), 429
+        blob = orjson.dumps(post)
+        post_ids.insert(0, post["id"])
+        post_blobs.insert(0, blob)
+        live_ids.add(post["id"])
+        invalidate_posts_cache()
+        next_id += 1
+        save_new_post(blob)
 
-    created_at = datetime.utcnow().isoformat() + "Z"
-    post = {
-        "id": next_id,
-        "title": title,
-        "name": name,
-        "content": content,
-        "created_at": created_at
-    }
-
-    posts.append(post)
-    next_id += 1
-    record_post_ip(ip)
-    save_posts()
-
-    return jsonify(post), 201
+    return app.response_class(blob, status=201, mimetype="application/json")
 
 @app.route("/api/posts/<int:post_id>", methods=["DELETE"])
 def delete_post(post_id):
@@ -124,26 +392,23 @@ def delete_post(post_id):
     if key != ADMIN_KEY:
         return jsonify({"error": "Unauthorized"}), 403
 
-    removed = False
-    for p in list(posts):
-        if p["id"] == post_id:
-            posts.remove(p)
-            removed = True
-            break
+    with posts_lock:
+        if post_id not in live_ids:
+            return jsonify({"error": "Post not found"}), 404
 
-    if removed:
-        save_posts()
-        return jsonify({"status": "deleted"}), 200
-    else:
-        return jsonify({"error": "Post not found"}), 404
+        live_ids.discard(post_id)
+        invalidate_posts_cache()
+        save_deleted_post(post_id)
+    return jsonify({"status": "deleted"}), 200
 
 @app.route("/", methods=["GET"])
 def index():
     return (
         "<h3>Render Blog API (persistent)</h3>"
         "<p>Endpoints: GET /api/posts, POST /api/posts, DELETE /api/posts/&lt;id&gt;</p>"
-        "<p>Data stored in posts.json</p>"
+        "<p>Data stored in posts.jsonl</p>"
     )
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=False)
+    # Local runs only; production is served by gunicorn (see gunicorn.conf.py)
+    app.run(host="0.0.0.0", debug=False, threaded=True)
@@ -0,0 +1,12 @@
+# Picked up automatically by `gunicorn app:app` from the project root.
+# Binds to $PORT when set (Render provides it).
+
+# One process: posts, next_id and the posts.jsonl writer live in that process's
+# memory, so extra workers would each hold a diverging copy, hand out clashing
+# ids and interleave appends. Rate limits can be shared by setting
+# RATE_LIMIT_STORAGE_URI to Redis; raise this only once posts move to a shared
+# store as well.
+workers = 1
+# Threads let GETs be served while a POST or DELETE is still in flight
+worker_class = "gthread"
+threads = 8